@@ -1,10 +1,9 @@
 import argparse
-import json
-from dataclasses import asdict
+
+import orjson
 
 from myaws_win import load_config
 from myaws_win.service import MyAwsService
-from myaws_win.tray_app import TrayApp
 
 
 def parse_args() -> argparse.Namespace:
@@ -27,9 +26,11 @@ def main() -> None:
 
     if args.snapshot:
         snapshot = service.get_snapshot()
-        print(json.dumps(asdict(snapshot), default=str, indent=2))
+        print(orjson.dumps(snapshot, option=orjson.OPT_INDENT_2, default=str).decode())
         return
 
+    from myaws_win.tray_app import TrayApp
+
     app = TrayApp(config)
     app.run()
 
@@ -157,7 +157,6 @@ import subprocess
 import requests
 import decimal
 import awspricing
-import six
 from currency_converter import CurrencyConverter
 
 from datetime import date
@@ -294,23 +293,28 @@ def init():
 
 # The update-pricing function: Retrieve EC2 pricing 
 def update_pricing(): 
-    # Purge existing database
-    clear_tinydb(database)
     # Get an EC2 price list from amazon
     ec2_offer = awspricing.offer('AmazonEC2')
+    # DB format change (bug in awspricing) aws_pricing = ec2_offer.ondemand_hourly(aws_vmgroup+aws_vmtype,operating_system=aws_ostype,region=aws_region)
+    # Ondemand makes a distinction between Used, ReservationBox, ...
+    # Walk the offer once and map every matching instance type to its price instead of searching all skus per type
+    aws_filter = {'operatingSystem':aws_ostype,'tenancy':'Shared','location':'EU (Frankfurt)','licenseModel':'No License required','preInstalledSw':'NA','capacitystatus':'Used'}
+    aws_prices = {}
+    for offer in ec2_offer._offer_data.values():
+       try:
+          attributes = offer['product']['attributes']
+          if attributes.get('instanceType') in aws_prices:
+             continue
+          if all(attributes.get(key) == value for (key,value) in aws_filter.items()):
+             aws_prices[attributes['instanceType']] = next(iter(next(iter(offer['terms']['OnDemand'].values()))['priceDimensions'].values()))['pricePerUnit']['USD']
+       except:
+          pass
+    # Purge existing database only once the new prices are known
+    clear_tinydb(database)
     # Retrieve latest pricing for vm and insert in database
     for (aws_vmgroup,aws_vmtypelist) in aws_vmtypes:
        for (aws_vmtype,aws_vmdesc) in aws_vmtypelist:
-          try:
-             # DB format change (bug in awspricing) aws_pricing = ec2_offer.ondemand_hourly(aws_vmgroup+aws_vmtype,operating_system=aws_ostype,region=aws_region)
-             # Ondemand makes a distinction between Used, ReservationBox, ...
-             sku = ec2_offer.search_skus(instance_type=aws_vmgroup+aws_vmtype,operating_system=aws_ostype,tenancy='Shared',location='EU (Frankfurt)',licenseModel='No License required', preInstalledSw='NA',capacitystatus='Used').pop()
-             print (ec2_offer._offer_data[sku]['terms']['OnDemand'])
-             aws_pricing = next(six.itervalues(next(six.itervalues(ec2_offer._offer_data[sku]['terms']['OnDemand']))['priceDimensions']))['pricePerUnit']['USD']
-             print (aws_pricing)
-          except:
-             aws_pricing = 'n/a'
-             pass 
+          aws_pricing = aws_prices.get(aws_vmgroup+aws_vmtype,'n/a')
           database.insert({'type':aws_vmgroup+aws_vmtype,'pricing':aws_pricing})
     # Store timestamp
     database.insert({'timestamp':str(datetime.datetime.now().strftime('%Y-%m-%d %H:%M'))})
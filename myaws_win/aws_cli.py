@@ -1,42 +1,48 @@
-import json
+import os
 import shutil
 import subprocess
+from functools import lru_cache
 from pathlib import Path
-from typing import Any, List
+from typing import Any, List, Tuple
+
+import orjson
 
 from .config import AppConfig
 
 
+@lru_cache(maxsize=None)
+def _resolve_executable(candidates: Tuple[str, ...], display_name: str) -> str:
+    for candidate in candidates:
+        if not candidate:
+            continue
+        candidate_path = Path(candidate).expanduser()
+        if candidate_path.name != candidate and candidate_path.is_file():
+            # Explicit path to the executable: no need to walk PATH.
+            return str(candidate_path)
+        resolved = shutil.which(str(candidate_path))
+        if resolved:
+            return resolved
+    primary = next((value for value in candidates if value), "")
+    raise RuntimeError(
+        f"{display_name} executable not found. Checked: {', '.join([c for c in candidates if c])}. "
+        f"Install {display_name} and ensure it is in PATH, or set the full path in config (current: '{primary}')."
+    )
+
+
 class AwsCli:
     def __init__(self, config: AppConfig):
         self.config = config
         self.aws_executable = self._resolve_aws_executable(config.aws_executable)
         self.ssh_executable = self._resolve_ssh_executable(config.ssh_executable)
+        self._base_argv: Tuple[str, ...] = tuple(self._base())
+        # Snapshot the environment once; an empty AWS_PAGER keeps the CLI from waiting on a pager.
+        self._env = {**os.environ, "AWS_PAGER": ""}
 
     def _resolve_aws_executable(self, configured: str) -> str:
-        candidates = [configured, "aws", "aws.exe", "aws.cmd"]
-        return self._resolve_executable(candidates, "AWS CLI")
+        return _resolve_executable((configured, "aws", "aws.exe", "aws.cmd"), "AWS CLI")
 
     def _resolve_ssh_executable(self, configured: str) -> str:
-        candidates = [configured, "ssh", "ssh.exe"]
-        return self._resolve_executable(candidates, "OpenSSH client")
-
-    @staticmethod
-    def _resolve_executable(candidates: List[str], display_name: str) -> str:
-        for candidate in candidates:
-            if not candidate:
-                continue
-            resolved = shutil.which(candidate)
-            if resolved:
-                return resolved
-            candidate_path = Path(candidate).expanduser()
-            if candidate_path.exists():
-                return str(candidate_path)
-        primary = next((value for value in candidates if value), "")
-        raise RuntimeError(
-            f"{display_name} executable not found. Checked: {', '.join([c for c in candidates if c])}. "
-            f"Install {display_name} and ensure it is in PATH, or set the full path in config (current: '{primary}')."
-        )
+        return _resolve_executable((configured, "ssh", "ssh.exe"), "OpenSSH client")
 
     def _base(self) -> List[str]:
         base = [self.aws_executable]
@@ -47,10 +53,11 @@ class AwsCli:
         return base
 
     def _run(self, args: List[str]) -> subprocess.CompletedProcess[str]:
-        command = self._base() + args
+        command = [*self._base_argv, *args]
         try:
             return subprocess.run(
                 command,
+                env=self._env,
                 capture_output=True,
                 text=True,
                 check=True,
@@ -63,11 +70,30 @@ class AwsCli:
             detail = stderr or stdout or str(exc)
             raise RuntimeError(f"AWS CLI call failed: {detail}") from exc
 
+    def _run_bytes(self, args: List[str]) -> bytes:
+        command = [*self._base_argv, *args]
+        with subprocess.Popen(
+            command, env=self._env, stdout=subprocess.PIPE, stderr=subprocess.PIPE
+        ) as process:
+            stdout, stderr = process.communicate()
+        if process.returncode != 0:
+            detail = (
+                stderr.decode("utf-8", errors="replace").strip()
+                or stdout.decode("utf-8", errors="replace").strip()
+                or f"Command {command} returned non-zero exit status {process.returncode}."
+            )
+            raise RuntimeError(f"AWS CLI call failed: {detail}")
+        return stdout
+
     def run_json(self, args: List[str]) -> Any:
-        output = self.run_text(args + ["--output", "json"])
-        if not output:
+        output = self._run_bytes(args + ["--output", "json"])
+        if not output or output.isspace():
             return {}
-        return json.loads(output)
+        try:
+            return orjson.loads(output)
+        except orjson.JSONDecodeError:
+            # The CLI may write names and tags in the console code page when stdout is a pipe.
+            return orjson.loads(output.decode("utf-8", errors="replace"))
 
     def run_text(self, args: List[str]) -> str:
         completed = self._run(args)
@@ -84,14 +110,14 @@ class AwsCli:
             "-o",
             "StrictHostKeyChecking=no",
             "-o",
-            f"UserKnownHostsFile={self.config.resolve_known_hosts()}",
+            f"UserKnownHostsFile={self.config.known_hosts_resolved}",
             f"{self.config.ssh_user}@{host}",
             f"bash -icl '{remote_command}'",
         ]
         return subprocess.call(ssh_args)
 
     def open_ssh_terminal(self, host: str) -> None:
-        known_hosts = self.config.resolve_known_hosts()
+        known_hosts = self.config.known_hosts_resolved
         cmd = (
             f'"{self.ssh_executable}" -q -o StrictHostKeyChecking=no '
             f'-o UserKnownHostsFile="{known_hosts}" {self.config.ssh_user}@{host}'
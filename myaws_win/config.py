@@ -1,6 +1,8 @@
+import copy
 import json
 import os
 from dataclasses import asdict, dataclass, field
+from functools import cached_property
 from pathlib import Path
 from typing import Any, Dict, List, Tuple
 
@@ -105,20 +107,31 @@ class AppConfig:
             return str(Path(self.ssh_known_hosts_file).expanduser())
         return str(Path.home() / ".ssh" / "amazon-vms")
 
+    @cached_property
+    def state_dir_resolved(self) -> Path:
+        return self.resolve_state_dir()
+
+    @cached_property
+    def known_hosts_resolved(self) -> str:
+        return self.resolve_known_hosts()
+
 
 def _deep_update(base: Dict[str, Any], override: Dict[str, Any]) -> Dict[str, Any]:
-    output = dict(base)
-    for key, value in override.items():
-        if isinstance(value, dict) and isinstance(output.get(key), dict):
-            output[key] = _deep_update(output[key], value)
-        else:
-            output[key] = value
+    output = copy.deepcopy(base)
+    stack = [(output, override)]
+    while stack:
+        target, source = stack.pop()
+        for key, value in source.items():
+            if isinstance(value, dict) and isinstance(target.get(key), dict):
+                stack.append((target[key], value))
+            else:
+                target[key] = value
     return output
 
 
 def load_config(config_path: str | None = None) -> AppConfig:
     defaults = AppConfig()
-    default_path = defaults.resolve_state_dir() / "config.json"
+    default_path = defaults.state_dir_resolved / "config.json"
     if config_path:
         source = Path(config_path)
     else:
@@ -1,19 +1,64 @@
 import datetime
-import json
+import os
+import sqlite3
 import threading
 import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass, field
+from functools import lru_cache
 from pathlib import Path
-from typing import Any, Dict, List, Tuple
+from typing import TYPE_CHECKING, Any, Callable, DefaultDict, Dict, Iterator, List, Sequence, Tuple
 
-from currency_converter import CurrencyConverter
-from tinydb import Query, TinyDB
+import orjson
+
+if TYPE_CHECKING:
+    from currency_converter import CurrencyConverter
 
 from .aws_cli import AwsCli
 from .config import AppConfig
 
 
-@dataclass
+COST_CACHE_MAX_AGE_SECONDS = {"DAILY": 6 * 3600, "MONTHLY": 24 * 3600}
+COST_QUERIES = {
+    "MONTHLY": "ResultsByTime[].Groups[].[Keys[0], Metrics.BlendedCost.Amount, Metrics.BlendedCost.Unit]",
+    "DAILY": "ResultsByTime[].[TimePeriod.Start, sum(Groups[].to_number(Metrics.BlendedCost.Amount))]",
+}
+CURRENCY_SYMBOLS = {"USD": "$", "EUR": "€"}
+ACTIVE_STATES = frozenset({"running", "stopped", "pending"})
+
+_CONVERTER: "CurrencyConverter | None" = None
+_CONVERTER_LOCK = threading.Lock()
+
+
+def _get_converter() -> "CurrencyConverter":
+    global _CONVERTER
+    with _CONVERTER_LOCK:
+        if _CONVERTER is None:
+            from currency_converter import CurrencyConverter
+
+            _CONVERTER = CurrencyConverter()
+        return _CONVERTER
+
+
+@lru_cache(maxsize=256)
+def _format_hourly_price(usd_price: float, currency: str) -> str:
+    value = usd_price
+    if currency != "USD":
+        value = _get_converter().convert(value, "USD", currency)
+    return f"{CURRENCY_SYMBOLS.get(currency, '$')}{value:.4f}/h"
+
+
+def _parse_launch_time(value: str | None) -> float | None:
+    if not value:
+        return None
+    try:
+        return datetime.datetime.fromisoformat(value.replace("Z", "+00:00")).timestamp()
+    except ValueError:
+        return None
+
+
+@dataclass(slots=True, frozen=True)
 class InstanceView:
     instance_id: str
     image_id: str
@@ -22,20 +67,22 @@ class InstanceView:
     public_dns: str
     public_ip: str
     launch_time: str
+    launch_epoch: float | None = None
 
 
-@dataclass
+@dataclass(slots=True, frozen=True)
 class ImageView:
     image_id: str
     name: str
     snapshot_id: str | None
 
 
-@dataclass
+@dataclass(slots=True, frozen=True)
 class AppSnapshot:
     timestamp: str
     images: List[ImageView] = field(default_factory=list)
     instances_by_image: Dict[str, List[InstanceView]] = field(default_factory=dict)
+    active_ids_by_image: Dict[str, Tuple[str, ...]] = field(default_factory=dict)
     volumes_count: int = 0
     volumes_gb: int = 0
     snapshots_count: int = 0
@@ -49,36 +96,60 @@ class MyAwsService:
     def __init__(self, config: AppConfig):
         self.config = config
         self.cli = AwsCli(config)
-        self.state_dir = config.resolve_state_dir()
-        self.database = TinyDB(self.state_dir / "myawspricing.json")
-        self.converter = CurrencyConverter()
+        self.state_dir = config.state_dir_resolved
         self.lock = threading.Lock()
+        self._db_lock = threading.Lock()
+        self.database = self._open_database()
+        self._last_snapshot: AppSnapshot | None = None
+        self._last_snapshot_at = 0.0
+        self._executor = ThreadPoolExecutor(max_workers=6, thread_name_prefix="myaws-snapshot")
+
+    def _open_database(self) -> sqlite3.Connection:
+        database = sqlite3.connect(self.state_dir / "myaws.sqlite", check_same_thread=False)
+        database.execute("PRAGMA journal_mode=WAL")
+        database.execute("PRAGMA synchronous=NORMAL")
+        with database:
+            database.execute("CREATE TABLE IF NOT EXISTS pricing (type TEXT PRIMARY KEY, usd REAL, updated TEXT)")
+            database.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+            if database.execute("SELECT 1 FROM pricing LIMIT 1").fetchone() is None:
+                database.executemany(
+                    "INSERT INTO pricing (type, usd, updated) VALUES (?, ?, '')",
+                    self._read_legacy_pricing(),
+                )
+        return database
 
-    def _clear_tinydb(self) -> None:
-        if hasattr(self.database, "drop_tables"):
-            self.database.drop_tables()
-            return
-        if hasattr(self.database, "purge_tables"):
-            self.database.purge_tables()
-            return
-        if hasattr(self.database, "purge"):
-            self.database.purge()
-            return
-        raise RuntimeError("Cannot clear TinyDB")
+    def _read_legacy_pricing(self) -> List[Tuple[str, float | None]]:
+        path = self.state_dir / "myawspricing.json"
+        if not path.exists():
+            return []
+        try:
+            data = orjson.loads(path.read_bytes())
+        except orjson.JSONDecodeError:
+            return []
+        if "_default" in data:
+            # Pricing file written by the TinyDB based releases.
+            pricing = {row["type"]: row["pricing"] for row in data["_default"].values() if "type" in row}
+        else:
+            pricing = data.get("pricing", {})
+        return [(vm_type, None if usd == "n/a" else float(usd)) for vm_type, usd in pricing.items()]
 
     def update_pricing(self) -> None:
         with self.lock:
-            self._clear_tinydb()
+            available = self._lookup_instance_prices()
+            updated = datetime.datetime.now().strftime("%Y-%m-%d %H:%M")
+            rows: List[Tuple[str, float | None, str]] = []
             for vm_group, vm_type_list in self.config.vm_types:
                 for vm_type, _ in vm_type_list:
-                    try:
-                        value = self._lookup_instance_price(vm_group + vm_type)
-                    except Exception:
-                        value = "n/a"
-                    self.database.insert({"type": vm_group + vm_type, "pricing": value})
-            self.database.insert({"timestamp": datetime.datetime.now().strftime("%Y-%m-%d %H:%M")})
-
-    def _lookup_instance_price(self, instance_type: str) -> str:
+                    usd = available.get(vm_group + vm_type)
+                    rows.append((vm_group + vm_type, float(usd) if usd else None, updated))
+            with self._db_lock, self.database:
+                self.database.execute("DELETE FROM pricing")
+                self.database.executemany("INSERT INTO pricing (type, usd, updated) VALUES (?, ?, ?)", rows)
+                self.database.execute(
+                    "INSERT OR REPLACE INTO meta (key, value) VALUES ('pricing_timestamp', ?)", (updated,)
+                )
+
+    def _lookup_instance_prices(self) -> Dict[str, str]:
         response = self.cli.run_json(
             [
                 "pricing",
@@ -86,27 +157,27 @@ class MyAwsService:
                 "--service-code",
                 "AmazonEC2",
                 "--filters",
-                f"Type=TERM_MATCH,Field=instanceType,Value={instance_type}",
                 f"Type=TERM_MATCH,Field=operatingSystem,Value={self.config.aws_operating_system}",
                 "Type=TERM_MATCH,Field=tenancy,Value=Shared",
                 f"Type=TERM_MATCH,Field=location,Value={self.config.aws_location_name}",
                 "Type=TERM_MATCH,Field=licenseModel,Value=No License required",
                 "Type=TERM_MATCH,Field=preInstalledSw,Value=NA",
                 "Type=TERM_MATCH,Field=capacitystatus,Value=Used",
-                "--max-results",
-                "1",
             ]
         )
-        price_list = response.get("PriceList", [])
-        if not price_list:
-            return "n/a"
-
-        first_entry = price_list[0]
-        if isinstance(first_entry, str):
-            payload = json.loads(first_entry)
-        else:
-            payload = first_entry
-
+        prices: Dict[str, str] = {}
+        for entry in response.get("PriceList", []):
+            payload = orjson.loads(entry) if isinstance(entry, str) else entry
+            instance_type = payload.get("product", {}).get("attributes", {}).get("instanceType")
+            if not instance_type or instance_type in prices:
+                continue
+            usd = self._ondemand_usd(payload)
+            if usd:
+                prices[instance_type] = usd
+        return prices
+
+    @staticmethod
+    def _ondemand_usd(payload: Dict[str, Any]) -> str | None:
         ondemand_terms = payload.get("terms", {}).get("OnDemand", {})
         for term in ondemand_terms.values():
             dimensions = term.get("priceDimensions", {})
@@ -114,20 +185,24 @@ class MyAwsService:
                 usd = dimension.get("pricePerUnit", {}).get("USD")
                 if usd:
                     return usd
-        return "n/a"
+        return None
 
-    def _cache_file(self, prefix: str, today: datetime.date) -> Path:
-        return self.state_dir / f"{prefix}-{today.strftime('%Y%m%d')}.json"
+    def _cache_file(self, prefix: str, month_start: datetime.date) -> Path:
+        return self.state_dir / f"{prefix}-{month_start.strftime('%Y%m')}.json"
 
-    def _get_cost_payload(self, granularity: str) -> Dict[str, Any]:
+    def _get_cost_payload(self, granularity: str) -> List[List[Any]]:
         today = datetime.date.today()
         month_start = today.replace(day=1)
         if today == month_start:
             month_start = (month_start - datetime.timedelta(days=1)).replace(day=1)
         prefix = "myaws-costs-monthly" if granularity == "MONTHLY" else "myaws-costs-daily"
-        file_path = self._cache_file(prefix, today)
-        if file_path.exists():
-            return json.loads(file_path.read_text(encoding="utf-8"))
+        file_path = self._cache_file(prefix, month_start)
+        max_age = COST_CACHE_MAX_AGE_SECONDS[granularity]
+        if file_path.exists() and time.time() - file_path.stat().st_mtime < max_age:
+            cached = orjson.loads(file_path.read_bytes())
+            # Files written before the query projection hold the raw response.
+            if isinstance(cached, list):
+                return cached
         try:
             payload = self.cli.run_json(
                 [
@@ -141,66 +216,94 @@ class MyAwsService:
                     "BlendedCost",
                     "--group-by",
                     "Type=DIMENSION,Key=SERVICE",
+                    "--query",
+                    COST_QUERIES[granularity],
                 ]
-            )
+            ) or []
         except RuntimeError as exc:
             message = str(exc)
             if "DataUnavailableException" in message or "GetCostAndUsage" in message:
-                return {"ResultsByTime": []}
+                return []
             raise
-        file_path.write_text(json.dumps(payload), encoding="utf-8")
+        file_path.write_bytes(orjson.dumps(payload))
         return payload
 
-    def _all_instances(self) -> List[InstanceView]:
-        raw = self.cli.run_json(
+    def _describe_instances(self) -> List[List[str | None]]:
+        return self.cli.run_json(
             [
                 "ec2",
                 "describe-instances",
                 "--query",
-                "Reservations[*].Instances[*].{PublicDnsName:PublicDnsName,State:State,InstanceType:InstanceType,PublicIpAddress:PublicIpAddress,InstanceId:InstanceId,ImageId:ImageId,LaunchTime:LaunchTime}",
+                "Reservations[*].Instances[*].[InstanceId,ImageId,State.Name,InstanceType,PublicDnsName,PublicIpAddress,LaunchTime][]",
             ]
         )
-        values: List[InstanceView] = []
-        for reservation in raw:
-            for instance in reservation:
-                values.append(
-                    InstanceView(
-                        instance_id=instance.get("InstanceId", ""),
-                        image_id=instance.get("ImageId", ""),
-                        state=instance.get("State", {}).get("Name", "unknown"),
-                        instance_type=instance.get("InstanceType", ""),
-                        public_dns=instance.get("PublicDnsName", ""),
-                        public_ip=instance.get("PublicIpAddress", ""),
-                        launch_time=instance.get("LaunchTime", ""),
-                    )
-                )
-        return values
 
-    def get_snapshot(self) -> AppSnapshot:
-        images_raw = self.cli.run_json(
+    @staticmethod
+    def _iter_instances(rows: List[List[str | None]]) -> Iterator[InstanceView]:
+        for instance_id, image_id, state, instance_type, public_dns, public_ip, launch_time in rows:
+            yield InstanceView(
+                instance_id=instance_id or "",
+                image_id=image_id or "",
+                state=state or "unknown",
+                instance_type=instance_type or "",
+                public_dns=public_dns or "",
+                public_ip=public_ip or "",
+                launch_time=launch_time or "",
+                launch_epoch=_parse_launch_time(launch_time),
+            )
+
+    def get_snapshot(self, force: bool = False) -> AppSnapshot:
+        max_age = self.config.refresh_interval_seconds // 4
+        if (
+            not force
+            and self._last_snapshot is not None
+            and time.monotonic() - self._last_snapshot_at < max_age
+        ):
+            return self._last_snapshot
+
+        images_future = self._executor.submit(
+            self.cli.run_json,
             [
                 "ec2",
                 "describe-images",
                 "--owners",
                 self.config.aws_owner_id,
+                "--filters",
+                "Name=state,Values=available,pending,failed",
                 "--query",
                 "Images[*].{ImageId:ImageId,Name:Name,SnapshotId:BlockDeviceMappings[0].Ebs.SnapshotId}",
-            ]
+            ],
         )
-        volumes = self.cli.run_json(["ec2", "describe-volumes", "--query", "Volumes[*].{Size:Size}"])
-        snapshots = self.cli.run_json(
+        volumes_future = self._executor.submit(
+            self.cli.run_json,
+            [
+                "ec2",
+                "describe-volumes",
+                "--query",
+                "{count: length(Volumes), total: sum(Volumes[*].Size)}",
+            ],
+        )
+        snapshots_future = self._executor.submit(
+            self.cli.run_json,
             [
                 "ec2",
                 "describe-snapshots",
                 "--owner-ids",
                 self.config.aws_owner_id,
                 "--query",
-                "Snapshots[*].{Size:VolumeSize}",
-            ]
+                "{count: length(Snapshots), total: sum(Snapshots[*].VolumeSize)}",
+            ],
         )
-        monthly = self._get_cost_payload("MONTHLY")
-        daily = self._get_cost_payload("DAILY")
-        instances = self._all_instances()
+        monthly_future = self._executor.submit(self._get_cost_payload, "MONTHLY")
+        daily_future = self._executor.submit(self._get_cost_payload, "DAILY")
+        instances_future = self._executor.submit(self._describe_instances)
+
+        images_raw = images_future.result()
+        volumes = volumes_future.result()
+        snapshots = snapshots_future.result()
+        monthly = monthly_future.result()
+        daily = daily_future.result()
+        instance_rows = instances_future.result()
 
         image_views = [
             ImageView(
@@ -210,51 +313,83 @@ class MyAwsService:
             )
             for image in images_raw
         ]
-        instance_map: Dict[str, List[InstanceView]] = {}
-        for item in instances:
-            instance_map.setdefault(item.image_id, []).append(item)
-
-        monthly_items: List[Tuple[str, float, str]] = []
-        monthly_total = 0.0
-        for month_period in monthly.get("ResultsByTime", []):
-            for group in month_period.get("Groups", []):
-                amount = float(group["Metrics"]["BlendedCost"]["Amount"])
-                monthly_total += amount
-                monthly_items.append((group["Keys"][0], amount, group["Metrics"]["BlendedCost"]["Unit"]))
-
-        daily_items: List[Tuple[str, float]] = []
-        for day in daily.get("ResultsByTime", []):
-            day_total = 0.0
-            for group in day.get("Groups", []):
-                day_total += float(group["Metrics"]["BlendedCost"]["Amount"])
-            daily_items.append((day["TimePeriod"]["Start"], day_total))
-
-        return AppSnapshot(
+        image_views.sort(key=lambda image: image.name.lower())
+        instance_map: DefaultDict[str, List[InstanceView]] = defaultdict(list)
+        for item in self._iter_instances(instance_rows):
+            instance_map[item.image_id].append(item)
+
+        monthly_items = [(name, float(amount), unit) for name, amount, unit in monthly]
+        monthly_total = sum(amount for _, amount, _ in monthly_items)
+        daily_items = [(start, float(total)) for start, total in daily]
+
+        snapshot = AppSnapshot(
             timestamp=datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
             images=image_views,
-            instances_by_image=instance_map,
-            volumes_count=len(volumes),
-            volumes_gb=sum(int(v["Size"]) for v in volumes),
-            snapshots_count=len(snapshots),
-            snapshots_gb=sum(int(s["Size"]) for s in snapshots),
+            instances_by_image=dict(instance_map),
+            active_ids_by_image={
+                image_id: tuple(i.instance_id for i in instances if i.state in ACTIVE_STATES)
+                for image_id, instances in instance_map.items()
+            },
+            volumes_count=volumes.get("count", 0),
+            volumes_gb=volumes.get("total", 0),
+            snapshots_count=snapshots.get("count", 0),
+            snapshots_gb=snapshots.get("total", 0),
             monthly_cost_total=monthly_total,
             monthly_cost_items=monthly_items,
             daily_cost_items=daily_items,
         )
+        self._last_snapshot = snapshot
+        self._last_snapshot_at = time.monotonic()
+        return snapshot
+
+    def save_snapshot(self, snapshot: AppSnapshot) -> None:
+        path = self.state_dir / "snapshot.json"
+        tmp_path = path.with_suffix(".tmp")
+        try:
+            tmp_path.write_bytes(orjson.dumps(snapshot))
+            os.replace(tmp_path, path)
+        except OSError:
+            # The warm-start cache is best-effort; a locked file must not fail a refresh.
+            pass
+
+    def touch_snapshot(self) -> None:
+        # An unchanged refresh still confirms the cached snapshot is current.
+        try:
+            os.utime(self.state_dir / "snapshot.json")
+        except OSError:
+            pass
+
+    def load_cached_snapshot(self, max_age: float) -> AppSnapshot | None:
+        path = self.state_dir / "snapshot.json"
+        try:
+            if time.time() - path.stat().st_mtime > max_age:
+                return None
+            data = orjson.loads(path.read_bytes())
+            return AppSnapshot(
+                **{
+                    **data,
+                    "images": [ImageView(**image) for image in data["images"]],
+                    "instances_by_image": {
+                        image_id: [InstanceView(**instance) for instance in instances]
+                        for image_id, instances in data["instances_by_image"].items()
+                    },
+                    "active_ids_by_image": {
+                        image_id: tuple(instance_ids)
+                        for image_id, instance_ids in data.get("active_ids_by_image", {}).items()
+                    },
+                    "monthly_cost_items": [tuple(item) for item in data["monthly_cost_items"]],
+                    "daily_cost_items": [tuple(item) for item in data["daily_cost_items"]],
+                }
+            )
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
 
     def instance_price(self, instance_type: str) -> str:
-        query = Query()
-        rows = self.database.search(query.type == instance_type)
-        if not rows or rows[0]["pricing"] == "n/a":
+        with self._db_lock:
+            row = self.database.execute("SELECT usd FROM pricing WHERE type = ?", (instance_type,)).fetchone()
+        if row is None or row[0] is None:
             return "n/a"
-        usd_price = float(rows[0]["pricing"])
-        if self.config.preferred_currency == "USD":
-            value = usd_price
-            symbol = "$"
-        else:
-            value = self.converter.convert(usd_price, "USD", self.config.preferred_currency)
-            symbol = "€" if self.config.preferred_currency == "EUR" else "$"
-        return f"{symbol}{value:.4f}/h"
+        return _format_hourly_price(row[0], self.config.preferred_currency)
 
     def run_instance(self, image_id: str, instance_type: str) -> str:
         result = self.cli.run_json(
@@ -274,16 +409,21 @@ class MyAwsService:
         )
         return result["Instances"][0]["InstanceId"]
 
-    def start_instance(self, instance_id: str) -> None:
-        self.cli.run_no_output(["ec2", "start-instances", "--instance-ids", instance_id])
+    # The batched calls are all-or-nothing: EC2 rejects the whole request if any id is in the wrong state.
+    def start_instances(self, instance_ids: Sequence[str]) -> None:
+        if not instance_ids:
+            return
+        self.cli.run_no_output(["ec2", "start-instances", "--instance-ids", *instance_ids])
 
-    def stop_instance(self, instance_id: str) -> None:
-        self.cli.run_no_output(["ec2", "stop-instances", "--instance-ids", instance_id, "--force"])
+    def stop_instances(self, instance_ids: Sequence[str]) -> None:
+        if not instance_ids:
+            return
+        self.cli.run_no_output(["ec2", "stop-instances", "--instance-ids", *instance_ids, "--force"])
 
     def terminate_instance(self, instance_id: str) -> None:
         self.cli.run_no_output(["ec2", "terminate-instances", "--instance-ids", instance_id])
 
-    def terminate_instances(self, instance_ids: List[str]) -> None:
+    def terminate_instances(self, instance_ids: Sequence[str]) -> None:
         if not instance_ids:
             return
         self.cli.run_no_output(["ec2", "terminate-instances", "--instance-ids", *instance_ids])
@@ -302,6 +442,15 @@ class MyAwsService:
         self.cli.run_no_output(args_1)
         self.cli.run_no_output(args_2)
 
+    def _run_concurrently(self, *actions: Callable[[], object]) -> None:
+        futures = [self._executor.submit(action) for action in actions]
+        errors = [error for error in (future.exception() for future in futures) if error is not None]
+        # Keep later failures visible as the cause chain of the first one.
+        for error, cause in zip(errors, errors[1:]):
+            error.__cause__ = cause
+        if errors:
+            raise errors[0]
+
     def open_ssh(self, dns_name: str) -> None:
         self.cli.open_ssh_terminal(dns_name)
 
@@ -340,8 +489,10 @@ class MyAwsService:
                 raise RuntimeError("Remote update command failed")
             new_image = self.create_image(instance_id)
             self.cli.run_no_output(["ec2", "wait", "image-available", "--image-ids", new_image])
-            self.terminate_instance(instance_id)
-            self.destroy_image(ami_to_update, ami_snapshot_id)
+            self._run_concurrently(
+                lambda: self.terminate_instance(instance_id),
+                lambda: self.destroy_image(ami_to_update, ami_snapshot_id),
+            )
             return new_image
         except Exception:
             self.terminate_instance(instance_id)
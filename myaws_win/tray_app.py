@@ -1,8 +1,10 @@
-import datetime
 import subprocess
 import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import cache, partial
 from pathlib import Path
-from typing import Callable, Optional
+from typing import Callable, Iterator, Optional
 
 import pystray
 from PIL import Image, ImageDraw
@@ -11,32 +13,66 @@ from .config import AppConfig
 from .service import AppSnapshot, ImageView, InstanceView, MyAwsService
 
 
+MENU_UPDATE_DELAY_SECONDS = 0.25
+INSTANCE_OP_BATCH_SECONDS = 0.2
+_TERMINATABLE_STATES = frozenset({"running", "stopped", "pending", "stopping"})
+
+
+@cache
+def _build_icon() -> Image.Image:
+    size = 64
+    image = Image.new("RGBA", (size, size), (0, 0, 0, 0))
+    draw = ImageDraw.Draw(image)
+    draw.rounded_rectangle((4, 4, 60, 60), radius=12, fill=(33, 150, 243, 255))
+    draw.text((16, 18), "AWS", fill=(255, 255, 255, 255))
+    return image
+
+
 class TrayApp:
     def __init__(self, config: AppConfig):
         self.config = config
         self.service = MyAwsService(config)
+        self._state_folder = Path(self.service.state_dir)
         self.state: Optional[AppSnapshot] = None
         self.last_error = ""
+        self._monthly_labels: list[str] = []
+        self._daily_labels: list[str] = []
+        self._storage_labels: tuple[str, ...] = ()
+        self._last_fingerprint: Optional[int] = None
         self._stop_event = threading.Event()
         self._refresh_lock = threading.Lock()
-        self.icon = pystray.Icon("MyAWS", self._build_icon(), "MyAWS")
+        self._menu_update_lock = threading.Lock()
+        self._pending_menu_update: Optional[threading.Timer] = None
+        self._executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="myaws-action")
+        # Image update/rebuild can hold a worker for tens of minutes; keep it off the action pool.
+        self._image_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="myaws-image")
+        self._pending_ops: dict[str, list[str]] = {"start": [], "stop": [], "terminate": []}
+        self._pending_ops_lock = threading.Lock()
+        self._pending_ops_timer: Optional[threading.Timer] = None
+        self._price_cache: dict[str, str] = {}
+        self._price_lock = threading.Lock()
+        self._flat_vm_types = self._flatten_vm_types()
+        self.icon = pystray.Icon("MyAWS", _build_icon(), "MyAWS")
         self.icon.menu = pystray.Menu(self._dynamic_menu)
 
-    def _build_icon(self) -> Image.Image:
-        size = 64
-        image = Image.new("RGBA", (size, size), (0, 0, 0, 0))
-        draw = ImageDraw.Draw(image)
-        draw.rounded_rectangle((4, 4, 60, 60), radius=12, fill=(33, 150, 243, 255))
-        draw.text((16, 18), "AWS", fill=(255, 255, 255, 255))
-        return image
+    def _flatten_vm_types(self) -> list[tuple[str, str, bool]]:
+        flat: list[tuple[str, str, bool]] = []
+        for vm_group, vm_list in self.config.vm_types:
+            for index, (vm_suffix, vm_desc) in enumerate(vm_list):
+                flat.append((vm_group + vm_suffix, vm_desc, index == len(vm_list) - 1))
+        if flat:
+            vm_type, vm_desc, _ = flat[-1]
+            flat[-1] = (vm_type, vm_desc, False)
+        return flat
 
     def run(self) -> None:
-        self.refresh(force=True)
+        self._set_state(self.service.load_cached_snapshot(self.config.refresh_interval_seconds * 4))
         worker = threading.Thread(target=self._auto_refresh_loop, daemon=True)
         worker.start()
         self.icon.run()
 
     def _auto_refresh_loop(self) -> None:
+        self.refresh(force=True)
         while not self._stop_event.is_set():
             self._stop_event.wait(self.config.refresh_interval_seconds)
             if self._stop_event.is_set():
@@ -49,7 +85,12 @@ class TrayApp:
         except Exception:
             pass
 
-    def _run_async(self, action: Callable[[], object], action_name: str) -> None:
+    def _run_async(
+        self,
+        action: Callable[[], object],
+        action_name: str,
+        executor: Optional[ThreadPoolExecutor] = None,
+    ) -> None:
         def runner() -> None:
             try:
                 action()
@@ -61,7 +102,36 @@ class TrayApp:
             finally:
                 self.refresh(force=True)
 
-        threading.Thread(target=runner, daemon=True).start()
+        (executor or self._executor).submit(runner)
+
+    def _queue_instance_op(self, op: str, instance_id: str) -> None:
+        with self._pending_ops_lock:
+            if instance_id not in self._pending_ops[op]:
+                self._pending_ops[op].append(instance_id)
+            if self._pending_ops_timer is None:
+                self._pending_ops_timer = threading.Timer(INSTANCE_OP_BATCH_SECONDS, self._flush_instance_ops)
+                self._pending_ops_timer.daemon = True
+                self._pending_ops_timer.start()
+
+    def _take_instance_ops(self) -> dict[str, list[str]]:
+        with self._pending_ops_lock:
+            if self._pending_ops_timer is not None:
+                self._pending_ops_timer.cancel()
+                self._pending_ops_timer = None
+            pending = {op: ids for op, ids in self._pending_ops.items() if ids}
+            self._pending_ops = {"start": [], "stop": [], "terminate": []}
+        return pending
+
+    def _instance_batch_action(self, op: str) -> Callable[[list[str]], None]:
+        return {
+            "start": self.service.start_instances,
+            "stop": self.service.stop_instances,
+            "terminate": self.service.terminate_instances,
+        }[op]
+
+    def _flush_instance_ops(self) -> None:
+        for op, ids in self._take_instance_ops().items():
+            self._run_async(partial(self._instance_batch_action(op), ids), f"{op.capitalize()} {', '.join(ids)}")
 
     def _async_menu_item(
         self,
@@ -70,18 +140,28 @@ class TrayApp:
         action_name: str,
         *,
         enabled: bool = True,
+        executor: Optional[ThreadPoolExecutor] = None,
     ) -> pystray.MenuItem:
         return pystray.MenuItem(
             label,
-            lambda *_: self._run_async(action, action_name),
+            lambda *_: self._run_async(action, action_name, executor),
             enabled=enabled,
         )
 
     def refresh(self, force: bool) -> None:
         if not self._refresh_lock.acquire(blocking=False):
             return
+        changed = True
         try:
-            self.state = self.service.get_snapshot()
+            snapshot = self.service.get_snapshot(force=force)
+            fingerprint = self._fingerprint(snapshot)
+            changed = force or bool(self.last_error) or fingerprint != self._last_fingerprint
+            if changed:
+                self._set_state(snapshot)
+                self._last_fingerprint = fingerprint
+                self.service.save_snapshot(snapshot)
+            else:
+                self.service.touch_snapshot()
             self.last_error = ""
             if force:
                 self._notify("MyAWS", "Data refreshed")
@@ -89,13 +169,64 @@ class TrayApp:
             self.last_error = str(exc)
         finally:
             self._refresh_lock.release()
-            self.icon.update_menu()
+            if changed:
+                self._schedule_menu_update()
+
+    @staticmethod
+    def _fingerprint(snapshot: AppSnapshot) -> int:
+        return hash(
+            (
+                tuple(
+                    instance for instances in snapshot.instances_by_image.values() for instance in instances
+                ),
+                tuple(snapshot.images),
+                snapshot.volumes_count,
+                snapshot.volumes_gb,
+                snapshot.snapshots_count,
+                snapshot.snapshots_gb,
+                tuple(snapshot.monthly_cost_items),
+                tuple(snapshot.daily_cost_items),
+            )
+        )
+
+    def _set_state(self, snapshot: Optional[AppSnapshot]) -> None:
+        if snapshot is None:
+            return
+        self._monthly_labels = [
+            f"{name}: {amount:.4f} {unit}" for name, amount, unit in snapshot.monthly_cost_items
+        ]
+        self._daily_labels = [f"{date}: {amount:.4f} USD" for date, amount in snapshot.daily_cost_items]
+        self._storage_labels = (
+            f"Volumes: {snapshot.volumes_count} objects, {snapshot.volumes_gb} GiB",
+            f"Snapshots: {snapshot.snapshots_count} objects, {snapshot.snapshots_gb} GiB",
+        )
+        self.state = snapshot
+
+    def _schedule_menu_update(self) -> None:
+        with self._menu_update_lock:
+            if self._pending_menu_update is not None:
+                self._pending_menu_update.cancel()
+            self._pending_menu_update = threading.Timer(MENU_UPDATE_DELAY_SECONDS, self.icon.update_menu)
+            self._pending_menu_update.daemon = True
+            self._pending_menu_update.start()
+
+    def _instance_price(self, vm_type: str) -> str:
+        with self._price_lock:
+            price = self._price_cache.get(vm_type)
+            if price is None:
+                price = self._price_cache[vm_type] = self.service.instance_price(vm_type)
+        return price
+
+    def _update_pricing(self) -> None:
+        self.service.update_pricing()
+        with self._price_lock:
+            self._price_cache.clear()
 
     def _dynamic_menu(self) -> pystray.Menu:
         return pystray.Menu(
             pystray.MenuItem(lambda _: self._title(), None, enabled=False),
             self._async_menu_item("Refresh now", lambda: self.refresh(True), "Refresh"),
-            self._async_menu_item("Update AWS pricing", self.service.update_pricing, "Pricing update"),
+            self._async_menu_item("Update AWS pricing", self._update_pricing, "Pricing update"),
             pystray.MenuItem("Images", pystray.Menu(*self._images_menu())),
             pystray.MenuItem("Storage", pystray.Menu(*self._storage_menu())),
             pystray.MenuItem("Costs", pystray.Menu(*self._costs_menu())),
@@ -111,35 +242,28 @@ class TrayApp:
             return "MyAWS | Loading..."
         return f"MyAWS | {len(self.state.images)} images | refreshed {self.state.timestamp}"
 
-    def _images_menu(self) -> list[pystray.MenuItem]:
+    def _images_menu(self) -> Iterator[pystray.MenuItem]:
         if not self.state:
-            return [pystray.MenuItem("No data", None, enabled=False)]
+            yield pystray.MenuItem("No data", None, enabled=False)
+            return
         if not self.state.images:
-            return [
-                pystray.MenuItem("No AMIs found", None, enabled=False),
-                pystray.MenuItem("Available VM options", pystray.Menu(*self._vm_options_menu())),
-            ]
-        return [
-            pystray.MenuItem(image.name, pystray.Menu(*self._single_image_menu(image)))
-            for image in sorted(self.state.images, key=lambda x: x.name.lower())
-        ]
+            yield pystray.MenuItem("No AMIs found", None, enabled=False)
+            yield pystray.MenuItem("Available VM options", pystray.Menu(*self._vm_options_menu()))
+            return
+        for image in self.state.images:
+            yield pystray.MenuItem(image.name, pystray.Menu(*self._single_image_menu(image)))
 
-    def _vm_options_menu(self) -> list[pystray.MenuItem]:
-        items: list[pystray.MenuItem] = []
-        for vm_group, vm_list in self.config.vm_types:
-            for vm_suffix, vm_desc in vm_list:
-                vm_type = vm_group + vm_suffix
-                price = self.service.instance_price(vm_type)
-                label = f"{vm_type} {vm_desc} {price}"
-                items.append(pystray.MenuItem(label, None, enabled=False))
-            items.append(pystray.Menu.SEPARATOR)
-        if items and items[-1] == pystray.Menu.SEPARATOR:
-            items.pop()
-        return items
+    def _vm_options_menu(self) -> Iterator[pystray.MenuItem]:
+        for vm_type, vm_desc, group_end in self._flat_vm_types:
+            price = self._instance_price(vm_type)
+            label = " ".join((vm_type, vm_desc, price))
+            yield pystray.MenuItem(label, None, enabled=False)
+            if group_end:
+                yield pystray.Menu.SEPARATOR
 
     def _single_image_menu(self, image: ImageView) -> list[pystray.MenuItem]:
         image_instances = self.state.instances_by_image.get(image.image_id, []) if self.state else []
-        instance_ids = [i.instance_id for i in image_instances if i.state in {"running", "stopped", "pending"}]
+        instance_ids = self.state.active_ids_by_image.get(image.image_id, ()) if self.state else ()
         return [
             pystray.MenuItem("Deploy new VM", pystray.Menu(*self._deploy_menu_items(image))),
             pystray.MenuItem("Instances", pystray.Menu(*self._instances_menu(image_instances))),
@@ -155,12 +279,14 @@ class TrayApp:
                 lambda: self.service.update_image(image.image_id, image.snapshot_id or "", rebuild=False),
                 f"Update image {image.name}",
                 enabled=bool(image.snapshot_id),
+                executor=self._image_executor,
             ),
             self._async_menu_item(
                 "Image: Rebuild",
                 lambda: self.service.update_image(image.image_id, image.snapshot_id or "", rebuild=True),
                 f"Rebuild image {image.name}",
                 enabled=bool(image.snapshot_id),
+                executor=self._image_executor,
             ),
             self._async_menu_item(
                 "Image: Destroy",
@@ -170,34 +296,35 @@ class TrayApp:
             ),
         ]
 
-    def _deploy_menu_items(self, image: ImageView) -> list[pystray.MenuItem]:
-        items: list[pystray.MenuItem] = []
-        for vm_group, vm_list in self.config.vm_types:
-            for vm_suffix, vm_desc in vm_list:
-                vm_type = vm_group + vm_suffix
-                price = self.service.instance_price(vm_type)
-                label = f"{vm_type} {vm_desc} {price}"
-                items.append(
-                    self._async_menu_item(
-                        label,
-                        lambda _img=image.image_id, _t=vm_type: self.service.run_instance(_img, _t),
-                        f"Deploy {vm_type}",
-                    )
-                )
-            items.append(pystray.Menu.SEPARATOR)
-        if items and items[-1] == pystray.Menu.SEPARATOR:
-            items.pop()
-        return items
+    def _deploy_menu_items(self, image: ImageView) -> Iterator[pystray.MenuItem]:
+        for vm_type, vm_desc, group_end in self._flat_vm_types:
+            price = self._instance_price(vm_type)
+            label = " ".join((vm_type, vm_desc, price))
+            yield self._async_menu_item(
+                label,
+                partial(self.service.run_instance, image.image_id, vm_type),
+                f"Deploy {vm_type}",
+            )
+            if group_end:
+                yield pystray.Menu.SEPARATOR
 
-    def _instances_menu(self, instances: list[InstanceView]) -> list[pystray.MenuItem]:
+    def _instances_menu(self, instances: list[InstanceView]) -> Iterator[pystray.MenuItem]:
         if not instances:
-            return [pystray.MenuItem("No instances", None, enabled=False)]
-        items: list[pystray.MenuItem] = []
+            yield pystray.MenuItem("No instances", None, enabled=False)
+            return
+        now = time.time()
         for instance in instances:
-            uptime_label = self._uptime_label(instance)
-            title = f"{instance.instance_id} | {instance.state} | {instance.instance_type} | {instance.public_ip or '-'} | {uptime_label}"
-            items.append(pystray.MenuItem(title, pystray.Menu(*self._instance_actions(instance))))
-        return items
+            uptime_label = self._uptime_label(instance, now)
+            title = " | ".join(
+                (
+                    instance.instance_id,
+                    instance.state,
+                    instance.instance_type,
+                    instance.public_ip or "-",
+                    uptime_label,
+                )
+            )
+            yield pystray.MenuItem(title, pystray.Menu(*self._instance_actions(instance)))
 
     def _instance_actions(self, instance: InstanceView) -> list[pystray.MenuItem]:
         return [
@@ -207,23 +334,20 @@ class TrayApp:
                 f"Connect {instance.instance_id}",
                 enabled=instance.state == "running" and bool(instance.public_dns),
             ),
-            self._async_menu_item(
+            pystray.MenuItem(
                 "Start",
-                lambda: self.service.start_instance(instance.instance_id),
-                f"Start {instance.instance_id}",
+                lambda *_: self._queue_instance_op("start", instance.instance_id),
                 enabled=instance.state == "stopped",
             ),
-            self._async_menu_item(
+            pystray.MenuItem(
                 "Stop",
-                lambda: self.service.stop_instance(instance.instance_id),
-                f"Stop {instance.instance_id}",
+                lambda *_: self._queue_instance_op("stop", instance.instance_id),
                 enabled=instance.state == "running",
             ),
-            self._async_menu_item(
+            pystray.MenuItem(
                 "Terminate",
-                lambda: self.service.terminate_instance(instance.instance_id),
-                f"Terminate {instance.instance_id}",
-                enabled=instance.state in {"running", "stopped", "pending", "stopping"},
+                lambda *_: self._queue_instance_op("terminate", instance.instance_id),
+                enabled=instance.state in _TERMINATABLE_STATES,
             ),
             self._async_menu_item(
                 "Create image",
@@ -245,35 +369,18 @@ class TrayApp:
             ),
         ]
 
-    def _uptime_label(self, instance: InstanceView) -> str:
-        if not instance.launch_time:
-            return "n/a"
-        try:
-            launch = instance.launch_time[:19]
-            dt = datetime.datetime.strptime(launch, "%Y-%m-%dT%H:%M:%S")
-            delta = datetime.datetime.utcnow() - dt
-            days = int(delta.total_seconds() // 86400)
-            hours = int((delta.total_seconds() % 86400) // 3600)
-            minutes = int((delta.total_seconds() % 3600) // 60)
-            return f"{days:02d}d:{hours:02d}h:{minutes:02d}m"
-        except Exception:
+    def _uptime_label(self, instance: InstanceView, now: float) -> str:
+        if instance.launch_epoch is None:
             return "n/a"
+        days, remainder = divmod(int(now - instance.launch_epoch), 86400)
+        hours, remainder = divmod(remainder, 3600)
+        minutes = remainder // 60
+        return f"{days:02d}d:{hours:02d}h:{minutes:02d}m"
 
     def _storage_menu(self) -> list[pystray.MenuItem]:
         if not self.state:
             return [pystray.MenuItem("No data", None, enabled=False)]
-        return [
-            pystray.MenuItem(
-                f"Volumes: {self.state.volumes_count} objects, {self.state.volumes_gb} GiB",
-                None,
-                enabled=False,
-            ),
-            pystray.MenuItem(
-                f"Snapshots: {self.state.snapshots_count} objects, {self.state.snapshots_gb} GiB",
-                None,
-                enabled=False,
-            ),
-        ]
+        return [pystray.MenuItem(label, None, enabled=False) for label in self._storage_labels]
 
     def _costs_menu(self) -> list[pystray.MenuItem]:
         if not self.state:
@@ -285,26 +392,33 @@ class TrayApp:
         ]
         return items
 
-    def _monthly_items(self) -> list[pystray.MenuItem]:
-        if not self.state or not self.state.monthly_cost_items:
-            return [pystray.MenuItem("No data", None, enabled=False)]
-        return [
-            pystray.MenuItem(f"{name}: {amount:.4f} {unit}", None, enabled=False)
-            for name, amount, unit in self.state.monthly_cost_items
-        ]
+    def _monthly_items(self) -> Iterator[pystray.MenuItem]:
+        if not self._monthly_labels:
+            yield pystray.MenuItem("No data", None, enabled=False)
+        for label in self._monthly_labels:
+            yield pystray.MenuItem(label, None, enabled=False)
 
-    def _daily_items(self) -> list[pystray.MenuItem]:
-        if not self.state or not self.state.daily_cost_items:
-            return [pystray.MenuItem("No data", None, enabled=False)]
-        return [
-            pystray.MenuItem(f"{date}: {amount:.4f} USD", None, enabled=False)
-            for date, amount in self.state.daily_cost_items
-        ]
+    def _daily_items(self) -> Iterator[pystray.MenuItem]:
+        if not self._daily_labels:
+            yield pystray.MenuItem("No data", None, enabled=False)
+        for label in self._daily_labels:
+            yield pystray.MenuItem(label, None, enabled=False)
 
     def _open_state_folder(self) -> None:
-        folder = Path(self.service.state_dir)
-        self._run_async(lambda: subprocess.Popen(["explorer", str(folder)]), "Open state folder")
+        subprocess.Popen(
+            ["explorer", str(self._state_folder)],
+            creationflags=getattr(subprocess, "CREATE_NO_WINDOW", 0),
+            close_fds=True,
+        )
 
     def _quit(self) -> None:
         self._stop_event.set()
+        # The action pool drops queued work on shutdown, so send clicks still in the batching window inline.
+        for op, ids in self._take_instance_ops().items():
+            try:
+                self._instance_batch_action(op)(ids)
+            except Exception as exc:
+                self._notify("MyAWS", f"{op.capitalize()} {', '.join(ids)} failed: {exc}")
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        self._image_executor.shutdown(wait=False, cancel_futures=True)
         self.icon.stop()